@@ -110,6 +110,29 @@ CREATE TABLE user_sessions (
     last_used TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
+-- Matching jobs table (one job per lead, scheduled by urgence)
+-- ATTENTION : le filigrane last_bien_id (biens_proposes.id > last_bien_id) et
+-- le stockage colonnaire (id en int64) supposent des id entiers croissants,
+-- comme dans les modèles SQLAlchemy du backend Python (flask init-db). Avec les
+-- id UUID de biens_proposes ci-dessus, le matching incrémental ne fonctionne pas.
+CREATE TABLE matching_jobs (
+    id SERIAL PRIMARY KEY,
+    lead_id UUID NOT NULL UNIQUE REFERENCES leads(id) ON DELETE CASCADE,
+    priorite INTEGER NOT NULL DEFAULT 1,
+    next_run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    lease_owner VARCHAR(100),
+    lease_expires_at TIMESTAMPTZ,
+    relancer BOOLEAN NOT NULL DEFAULT false,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_bien_id INTEGER NOT NULL DEFAULT 0,
+    last_run_at TIMESTAMPTZ,
+    last_finished_at TIMESTAMPTZ,
+    last_duration_ms INTEGER,
+    last_lag_ms INTEGER,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
 -- Indexes for performance optimization
 CREATE INDEX idx_leads_agent_id ON leads(agent_id);
 CREATE INDEX idx_leads_statut ON leads(statut) WHERE statut != 'CLOS';
@@ -118,6 +141,7 @@ CREATE INDEX idx_leads_urgence ON leads(urgence) WHERE urgence = 'FORTE';
 CREATE INDEX idx_biens_lead_id_date ON biens_proposes(lead_id, date_detection DESC);
 CREATE INDEX idx_biens_url_hash ON biens_proposes(url_hash);
 CREATE INDEX idx_biens_source ON biens_proposes(source);
+CREATE INDEX idx_biens_updated_at ON biens_proposes(updated_at);
 CREATE INDEX idx_biens_flags ON biens_proposes(interessant, contacte, refuse, a_revoir) WHERE interessant OR contacte OR refuse OR a_revoir;
 
 CREATE INDEX idx_historique_actor ON historique_actions(actor_type, actor_id);
@@ -130,6 +154,9 @@ CREATE INDEX idx_sessions_user_id ON user_sessions(user_id);
 CREATE INDEX idx_sessions_token ON user_sessions(refresh_token);
 CREATE INDEX idx_sessions_expires ON user_sessions(expires_at);
 
+CREATE INDEX idx_matching_jobs_due ON matching_jobs(priorite, next_run_at);
+CREATE INDEX idx_matching_jobs_finished ON matching_jobs(last_finished_at);
+
 -- Unique constraints
 CREATE UNIQUE INDEX idx_biens_unique_per_lead ON biens_proposes(lead_id, url_hash);
 
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Sigma Matching - Benchmarks backend
+Temps de démarrage mesurés dans un interpréteur neuf (comme un worker gunicorn)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import app as module
+t1 = time.perf_counter()
+with module.app.app_context():
+    module.bootstrap_database()
+t2 = time.perf_counter()
+response = module.app.test_client().get('/api/health')
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'init_db_ms': (t2 - t1) * 1000,
+    'first_request_ms': (t3 - t2) * 1000,
+    'first_request_status': response.status_code,
+    'numpy_loaded': 'numpy' in sys.modules,
+}))
+"""
+
+
+def bench_startup(runs=5):
+    """Import de l'application, init-db et première requête"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', STARTUP_SCRIPT],
+                cwd=here, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    results = bench_startup()
+    print("== Démarrage ==")
+    for key in ('import_ms', 'init_db_ms', 'first_request_ms'):
+        values = sorted(r[key] for r in results)
+        print(f"startup.{key}: median={values[len(values) // 2]:.1f} min={values[0]:.1f} max={values[-1]:.1f}")
+    print(f"startup.first_request_status: {results[-1]['first_request_status']}")
+    print(f"startup.numpy_loaded: {results[-1]['numpy_loaded']}")
+
+
+if __name__ == '__main__':
+    main()
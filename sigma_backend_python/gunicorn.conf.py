@@ -0,0 +1,30 @@
+"""
+Sigma Matching - Configuration gunicorn
+gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+
+# Import de l'application dans le master puis fork des workers : démarrage et
+# redémarrages plus rapides. create_app n'ouvre aucune connexion, rien n'est
+# partagé entre processus.
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+
+def post_fork(server, worker):
+    # Par sécurité, si le master a ouvert des connexions avant le fork : le
+    # worker abandonne le pool hérité sans fermer les sockets du master
+    if preload_app:
+        from app import app, db
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # Les threads ne survivent pas au fork : démarrage dans chaque worker
+    from app import start_background_services
+    start_background_services(worker.wsgi)
@@ -0,0 +1,376 @@
+"""
+Sigma Matching - Stockage colonnaire des biens
+Instantané compact des champs chauds de biens_proposes (NumPy), rafraîchi
+de façon incrémentale et partagé en lecture seule (mmap) par tous les workers
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import DateTime, text
+
+logger = logging.getLogger(__name__)
+
+# Code 0 réservé aux types inconnus, les autres suivent l'enum bien_type
+TYPES_BIEN = ('APPARTEMENT', 'MAISON', 'TERRAIN', 'LOCAL', 'AUTRE')
+TYPE_BIEN_CODES = {type_bien: code for code, type_bien in enumerate(TYPES_BIEN, start=1)}
+
+# Même convention pour le statut des biens (sélecteur du frontend)
+STATUTS_BIEN = ('NOUVEAU', 'VU', 'INTERESSE', 'REJETE')
+STATUT_CODES = {statut: code for code, statut in enumerate(STATUTS_BIEN, start=1)}
+
+# Colonnes stockées et leur type NumPy (NaN / 0 / -1 = valeur absente)
+COLONNES = {
+    'id': np.int64,
+    'lead_id': np.int64,
+    'agent_id': np.int64,
+    'prix_eur': np.int32,
+    'surface_m2': np.float32,
+    'nb_pieces': np.int16,
+    'type_bien': np.uint8,
+    'ville_id': np.int32,
+    'score_match': np.float32,
+    'statut': np.uint8,
+    'date_detection': 'datetime64[s]',
+}
+
+BATCH_SIZE = 10000
+GENERATIONS_CONSERVEES = 2
+
+# Les id PostgreSQL peuvent être validés dans le désordre et les biens déjà
+# stockés peuvent changer : on relit les nouveaux id et tout ce qui a été
+# modifié depuis le dernier passage, avec une marge de chevauchement.
+# updated_at est NOT NULL et indexé (idx_biens_updated_at) : les deux branches
+# du filtre passent par un index, sans parcours complet de la table
+CHEVAUCHEMENT = timedelta(minutes=10)
+
+# agent_id vient du lead propriétaire : chaque bien n'est proposé qu'aux leads
+# du même agent (pas de fuite des biens sourcés d'une agence vers une autre)
+REFRESH_QUERY = text("""
+    SELECT b.id, b.lead_id, l.agent_id, b.prix_eur, b.surface_m2, b.nb_pieces,
+           b.type_bien, b.ville, b.score_match, b.statut, b.date_detection, b.updated_at
+    FROM biens_proposes b
+    JOIN leads l ON l.id = b.lead_id
+    WHERE b.id > :last_id OR b.updated_at >= :depuis
+    ORDER BY b.id
+""").columns(date_detection=DateTime, updated_at=DateTime)
+
+
+def normaliser_ville(ville):
+    """Clé de ville commune au stockage et au matching"""
+    return (ville or '').strip().upper()
+
+
+def code_type_bien(type_bien):
+    return TYPE_BIEN_CODES.get((type_bien or '').upper(), 0)
+
+
+def code_statut(statut):
+    return STATUT_CODES.get((statut or '').upper(), 0)
+
+
+class ListingSnapshot:
+    """Vue en lecture seule d'une génération du stockage"""
+
+    def __init__(self, path, manifest, columns):
+        self.path = path
+        self.manifest = manifest
+        self.columns = columns
+        self.villes = manifest['villes']
+        self._ville_index = {ville: i for i, ville in enumerate(self.villes)}
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def last_id(self):
+        return self.manifest['last_id']
+
+    def ville_ids(self, villes):
+        return [self._ville_index[v] for v in map(normaliser_ville, villes) if v in self._ville_index]
+
+    def mask(self, agent_id=None, type_bien=None, villes=None, prix_max=None, surface_min=None,
+             surface_max=None, nb_pieces_min=None, nb_pieces_max=None, depuis=None,
+             apres_id=None, exclure_statuts=None):
+        """Masque booléen des biens respectant les critères fournis"""
+        cols = self.columns
+        mask = np.ones(len(self), dtype=bool)
+
+        if agent_id is not None:
+            mask &= cols['agent_id'] == agent_id
+        if type_bien:
+            mask &= cols['type_bien'] == code_type_bien(type_bien)
+        if villes:
+            mask &= np.isin(cols['ville_id'], self.ville_ids(villes))
+        if prix_max is not None:
+            mask &= cols['prix_eur'] <= prix_max
+        # Les valeurs absentes (NaN / 0) ne sont pas exclues par les bornes
+        if surface_min is not None:
+            mask &= ~(cols['surface_m2'] < surface_min)
+        if surface_max is not None:
+            mask &= ~(cols['surface_m2'] > surface_max)
+        if nb_pieces_min is not None:
+            mask &= (cols['nb_pieces'] == 0) | (cols['nb_pieces'] >= nb_pieces_min)
+        if nb_pieces_max is not None:
+            mask &= (cols['nb_pieces'] == 0) | (cols['nb_pieces'] <= nb_pieces_max)
+        if depuis is not None:
+            mask &= cols['date_detection'] >= np.datetime64(depuis, 's')
+        if apres_id is not None:
+            mask &= cols['id'] > apres_id
+        if exclure_statuts:
+            mask &= ~np.isin(cols['statut'], [code_statut(statut) for statut in exclure_statuts])
+
+        return mask
+
+    def stats(self, mask=None):
+        """Statistiques de prix par type de bien, calculées sur les vecteurs"""
+        return {
+            **combined_stats([(self, mask)]),
+            'generation': self.manifest['generation'],
+            'built_at': self.manifest['built_at'],
+        }
+
+
+def combined_stats(selections):
+    """
+    Statistiques sur l'union de plusieurs instantanés [(snapshot, mask)] : les
+    vecteurs sont concaténés, les médianes sont donc exactes (pas de moyenne
+    de médianes entre shards)
+    """
+    prix, surface, types = [], [], []
+    for snapshot, mask in selections:
+        if mask is None:
+            mask = np.ones(len(snapshot), dtype=bool)
+        prix.append(snapshot['prix_eur'][mask].astype(np.float64))
+        surface.append(snapshot['surface_m2'][mask].astype(np.float64))
+        types.append(snapshot['type_bien'][mask])
+    prix = np.concatenate(prix) if prix else np.empty(0)
+    surface = np.concatenate(surface) if surface else np.empty(0)
+    types = np.concatenate(types) if types else np.empty(0, dtype=np.uint8)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prix_m2 = np.where(surface > 0, prix / surface, np.nan)
+
+    par_type = {}
+    for code, type_bien in enumerate(('INCONNU',) + TYPES_BIEN):
+        selection = types == code
+        nb = int(selection.sum())
+        if not nb:
+            continue
+        par_type[type_bien] = {
+            'total': nb,
+            'prix_median': float(np.median(prix[selection])),
+            'prix_m2_median': _nanmedian(prix_m2[selection]),
+        }
+
+    return {
+        'total': int(prix.size),
+        'prix_median': float(np.median(prix)) if prix.size else None,
+        'prix_moyen': float(prix.mean()) if prix.size else None,
+        'prix_m2_median': _nanmedian(prix_m2),
+        'par_type': par_type,
+    }
+
+
+def _nanmedian(values):
+    values = values[~np.isnan(values)]
+    return float(np.median(values)) if values.size else None
+
+
+class ListingStore:
+    """
+    Répertoire de générations immuables :
+        CURRENT            -> nom de la génération active
+        gen-000001/        -> manifest.json + une colonne .npy par champ
+    Les lecteurs mappent les fichiers en lecture seule : le page cache est
+    partagé entre les workers, sans copie par processus.
+    """
+
+    def __init__(self, path, reload_interval=5):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._snapshot = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    # ---------- Lecture ----------
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.path, 'CURRENT')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load(self, generation):
+        gen_path = os.path.join(self.path, generation)
+        with open(os.path.join(gen_path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        # Les générations publiées avant l'ajout d'une colonne sont incomplètes
+        columns = {
+            name: np.load(os.path.join(gen_path, f'{name}.npy'), mmap_mode='r')
+            for name in COLONNES
+            if os.path.exists(os.path.join(gen_path, f'{name}.npy'))
+        }
+        return ListingSnapshot(gen_path, manifest, columns)
+
+    def _complete(self, snapshot):
+        return snapshot is not None and set(snapshot.columns) == set(COLONNES)
+
+    def snapshot(self):
+        """Génération active, rechargée au plus toutes les reload_interval secondes"""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked_at < self.reload_interval:
+            return self._snapshot
+
+        with self._lock:
+            if self._snapshot is None or now - self._checked_at >= self.reload_interval:
+                generation = self._current_generation()
+                if generation is None:
+                    self._snapshot = None
+                elif self._snapshot is None or self._snapshot.manifest['generation'] != generation:
+                    snapshot = self._load(generation)
+                    if self._complete(snapshot):
+                        self._snapshot = snapshot
+                        logger.info(f"Stockage des biens chargé: {generation} ({len(snapshot)} biens)")
+                    else:
+                        # Ancien format : inutilisable jusqu'au prochain rafraîchissement
+                        self._snapshot = None
+                        logger.warning(f"Stockage des biens incomplet: {generation}, reconstruction requise")
+                self._checked_at = now
+        return self._snapshot
+
+    # ---------- Écriture ----------
+
+    def refresh(self, engine, full=False, wait=True):
+        """
+        Relit les nouveaux biens et ceux modifiés depuis le dernier passage,
+        les fusionne par id et publie une nouvelle génération si quelque chose
+        a changé. full=True reconstruit tout (prise en compte des suppressions).
+        wait=False abandonne (retourne None) si un autre processus rafraîchit déjà.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+
+            generation = self._current_generation()
+            previous = None if full or generation is None else self._load(generation)
+            if previous is not None and not self._complete(previous):
+                previous = None
+            last_id = previous.last_id if previous else 0
+            watermark = previous.manifest.get('watermark') if previous else None
+            watermark = datetime.fromisoformat(watermark) if watermark else None
+            villes = list(previous.villes) if previous else []
+            ville_index = {ville: i for i, ville in enumerate(villes)}
+
+            lues = {name: [] for name in COLONNES}
+            depuis = watermark - CHEVAUCHEMENT if watermark else datetime.min
+            with engine.connect() as connection:
+                result = connection.execution_options(stream_results=True).execute(
+                    REFRESH_QUERY, {'last_id': last_id, 'depuis': depuis}
+                )
+                while True:
+                    rows = result.fetchmany(BATCH_SIZE)
+                    if not rows:
+                        break
+                    for row in rows:
+                        ville = normaliser_ville(row.ville)
+                        if ville and ville not in ville_index:
+                            ville_index[ville] = len(villes)
+                            villes.append(ville)
+                        if watermark is None or row.updated_at > watermark:
+                            watermark = row.updated_at
+                        lues['id'].append(row.id)
+                        lues['lead_id'].append(row.lead_id)
+                        lues['agent_id'].append(row.agent_id)
+                        lues['prix_eur'].append(row.prix_eur)
+                        lues['surface_m2'].append(np.nan if row.surface_m2 is None else row.surface_m2)
+                        lues['nb_pieces'].append(row.nb_pieces or 0)
+                        lues['type_bien'].append(code_type_bien(row.type_bien))
+                        lues['ville_id'].append(ville_index[ville] if ville else -1)
+                        lues['score_match'].append(np.nan if row.score_match is None else row.score_match)
+                        lues['statut'].append(code_statut(row.statut))
+                        lues['date_detection'].append(row.date_detection or datetime.utcnow())
+
+            lues = {name: np.array(valeurs, dtype=COLONNES[name]) for name, valeurs in lues.items()}
+            if previous is not None and _inchangees(previous, lues):
+                logger.info("Stockage des biens à jour, aucune nouvelle génération")
+                return previous
+
+            colonnes = lues
+            if previous is not None:
+                # Les lignes relues remplacent leur version stockée
+                gardees = ~np.isin(previous['id'], lues['id'])
+                colonnes = {
+                    name: np.concatenate([previous[name][gardees], lues[name]])
+                    for name in COLONNES
+                }
+                ordre = np.argsort(colonnes['id'], kind='stable')
+                colonnes = {name: valeurs[ordre] for name, valeurs in colonnes.items()}
+
+            numero = int(generation.split('-')[1]) + 1 if generation else 1
+            new_generation = f'gen-{numero:06d}'
+            gen_path = os.path.join(self.path, new_generation)
+            os.makedirs(gen_path, exist_ok=True)
+
+            for name, valeurs in colonnes.items():
+                np.save(os.path.join(gen_path, f'{name}.npy'), valeurs)
+
+            rows = len(colonnes['id'])
+            manifest = {
+                'generation': new_generation,
+                'rows': rows,
+                'last_id': int(colonnes['id'][-1]) if rows else 0,
+                'watermark': (watermark or datetime.utcnow()).isoformat(),
+                'villes': villes,
+                'built_at': datetime.utcnow().isoformat(),
+            }
+            with open(os.path.join(gen_path, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+
+            # Publication atomique : les lecteurs voient l'ancienne ou la nouvelle génération
+            tmp_current = os.path.join(self.path, 'CURRENT.tmp')
+            with open(tmp_current, 'w') as f:
+                f.write(new_generation)
+            os.replace(tmp_current, os.path.join(self.path, 'CURRENT'))
+
+            self._purge(new_generation)
+            logger.info(f"Stockage des biens publié: {new_generation} ({rows} biens)")
+            return self._load(new_generation)
+
+    def _purge(self, current):
+        """Supprime les anciennes générations (les mmaps ouverts restent valides)"""
+        generations = sorted(
+            name for name in os.listdir(self.path)
+            if name.startswith('gen-') and name <= current
+        )
+        for name in generations[:-GENERATIONS_CONSERVEES]:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+def _inchangees(previous, lues):
+    """Vrai si toutes les lignes relues sont déjà stockées à l'identique"""
+    if not len(lues['id']):
+        return True
+    ids = previous['id']
+    positions = np.searchsorted(ids, lues['id'])
+    if np.any(positions >= len(ids)) or np.any(ids[np.minimum(positions, len(ids) - 1)] != lues['id']):
+        return False
+    for name in COLONNES:
+        stockees = previous[name][positions]
+        equal_nan = np.issubdtype(stockees.dtype, np.floating)
+        if not np.array_equal(stockees, lues[name], equal_nan=equal_nan):
+            return False
+    return True
@@ -0,0 +1,268 @@
+"""
+Sigma Matching - Ordonnanceur des jobs de matching
+File de priorité alimentée par la table matching_jobs (un job par lead),
+avec baux (leases) pour partager le travail entre processus
+"""
+
+import itertools
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import g
+from sqlalchemy import case
+
+logger = logging.getLogger(__name__)
+
+# Plus la priorité est basse, plus le job passe tôt
+URGENCE_PRIORITES = {'FORTE': 0, 'MOYENNE': 1, 'FAIBLE': 2}
+PRIORITE_DEFAUT = URGENCE_PRIORITES['MOYENNE']
+
+INTERVALLES_DEFAUT = {
+    'FORTE': timedelta(minutes=5),
+    'MOYENNE': timedelta(minutes=30),
+    'FAIBLE': timedelta(hours=2),
+}
+
+# Fenêtre glissante utilisée pour le débit et le retard moyen
+FENETRE_METRIQUES = 300
+
+
+def priorite_pour(urgence):
+    return URGENCE_PRIORITES.get(urgence, PRIORITE_DEFAUT)
+
+
+def job_stats(db, job_model):
+    """
+    Profondeur de file, retard et débit calculés depuis la table : les
+    chiffres couvrent tous les processus qui exécutent des jobs
+    """
+    Job = job_model
+    now = datetime.utcnow()
+    fenetre = now - timedelta(seconds=FENETRE_METRIQUES)
+
+    dus = Job.query.filter(Job.next_run_at <= now)
+    par_priorite = dict(
+        db.session.query(Job.priorite, db.func.count(Job.id))
+        .filter(Job.next_run_at <= now).group_by(Job.priorite).all()
+    )
+    plus_ancien = dus.order_by(Job.next_run_at).first()
+    recents = db.session.query(
+        db.func.count(Job.id),
+        db.func.count(Job.last_error),
+        db.func.avg(Job.last_lag_ms),
+        db.func.avg(Job.last_duration_ms)
+    ).filter(Job.last_finished_at >= fenetre).one()
+    total, erreurs, lag_moyen_ms, duree_moyenne_ms = recents
+
+    return {
+        'jobs_total': Job.query.count(),
+        'jobs_dus': dus.count(),
+        'jobs_dus_par_urgence': {
+            urgence: par_priorite.get(priorite, 0) for urgence, priorite in URGENCE_PRIORITES.items()
+        },
+        'jobs_en_cours': Job.query.filter(Job.lease_expires_at > now).count(),
+        'jobs_en_erreur': Job.query.filter(Job.attempts > 0).count(),
+        'retard_max_s': (now - plus_ancien.next_run_at).total_seconds() if plus_ancien else 0,
+        'retard_moyen_s': float(lag_moyen_ms) / 1000 if lag_moyen_ms is not None else None,
+        'duree_moyenne_s': float(duree_moyenne_ms) / 1000 if duree_moyenne_ms is not None else None,
+        'debit_par_minute': total * 60 / FENETRE_METRIQUES,
+        'erreurs_par_minute': erreurs * 60 / FENETRE_METRIQUES,
+    }
+
+
+class MatchingScheduler:
+    """
+    Un thread de polling réclame les jobs dus (ordre : priorité puis échéance)
+    et les pousse dans une PriorityQueue locale consommée par les workers.
+    Un job n'est exécuté que par le détenteur de son bail, ce qui déduplique
+    les exécutions entre threads, workers gunicorn et machines.
+    """
+
+    def __init__(self, app, db, job_model, handler, sync=None, workers=2,
+                 poll_interval=5, sync_interval=60, lease_duration=timedelta(minutes=5),
+                 intervalles=None, shard=None, refresh=None, refresh_interval=60):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.handler = handler
+        self.sync = sync
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.sync_interval = sync_interval
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self.lease_duration = lease_duration
+        self.intervalles = {
+            URGENCE_PRIORITES[urgence]: intervalle
+            for urgence, intervalle in {**INTERVALLES_DEFAUT, **(intervalles or {})}.items()
+        }
+        self.shard = shard
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._queue = queue.PriorityQueue()
+        self._queued = set()
+        self._sequence = itertools.count()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._last_sync = 0
+        self._last_refresh = 0
+
+    # ---------- Cycle de vie ----------
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads.append(threading.Thread(target=self._poll_loop, name='matching-poll', daemon=True))
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f'matching-worker-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Ordonnanceur de matching démarré ({self.owner}, shard {self.shard}, {self.workers} workers)")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        logger.info("Ordonnanceur de matching arrêté")
+
+    @contextmanager
+    def _context(self):
+        """Contexte applicatif lié au shard de cet ordonnanceur"""
+        with self.app.app_context():
+            g.shard = self.shard
+            yield
+
+    def intervalle(self, priorite):
+        return self.intervalles.get(priorite, self.intervalles[PRIORITE_DEFAUT])
+
+    # ---------- Polling ----------
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            with self._context():
+                try:
+                    if self.sync and time.monotonic() - self._last_sync >= self.sync_interval:
+                        self.sync()
+                        self._last_sync = time.monotonic()
+                    if self.refresh and time.monotonic() - self._last_refresh >= self.refresh_interval:
+                        self.refresh()
+                        self._last_refresh = time.monotonic()
+                    self._claim_due_jobs()
+                except Exception as e:
+                    logger.error(f"Erreur du polling des jobs de matching: {e}")
+                    self.db.session.rollback()
+            self._stop.wait(self.poll_interval)
+
+    def _claim_due_jobs(self):
+        """Réclamer autant de jobs dus que de places libres dans la file locale"""
+        Job = self.job_model
+        capacite = self.workers * 2 - self._queue.qsize()
+        if capacite <= 0:
+            return
+
+        now = datetime.utcnow()
+        candidats = Job.query.filter(
+            Job.next_run_at <= now,
+            self.db.or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now)
+        ).order_by(Job.priorite, Job.next_run_at).limit(capacite).all()
+
+        for job in candidats:
+            if job.id in self._queued:
+                continue
+            # Prise du bail conditionnelle : un seul processus gagne
+            claimed = Job.query.filter(
+                Job.id == job.id,
+                self.db.or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now)
+            ).update({
+                'lease_owner': self.owner,
+                'lease_expires_at': now + self.lease_duration,
+                'relancer': False
+            }, synchronize_session=False)
+            self.db.session.commit()
+            if claimed:
+                with self._lock:
+                    self._queued.add(job.id)
+                self._queue.put((job.priorite, job.next_run_at, next(self._sequence), job.id))
+
+    # ---------- Exécution ----------
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                priorite, due_at, _, job_id = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                with self._context():
+                    self._execute(job_id, due_at)
+            except Exception as e:
+                logger.error(f"Erreur du worker de matching sur le job {job_id}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(job_id)
+                self._queue.task_done()
+
+    def _execute(self, job_id, due_at):
+        Job = self.job_model
+        job = Job.query.filter_by(id=job_id, lease_owner=self.owner).first()
+        if not job:
+            # Bail expiré et repris par un autre processus
+            return
+
+        started_at = datetime.utcnow()
+        lag = (started_at - due_at).total_seconds()
+        erreur = None
+        try:
+            self.handler(job)
+            # Écritures du handler sur le job (ex. last_bien_id)
+            self.db.session.flush()
+        except Exception as e:
+            self.db.session.rollback()
+            erreur = str(e)
+            logger.error(f"Erreur du matching pour le lead {job.lead_id}: {e}")
+
+        finished_at = datetime.utcnow()
+        if erreur:
+            attempts = (job.attempts or 0) + 1
+            # Backoff exponentiel, plafonné à l'intervalle normal
+            retry = min(timedelta(seconds=30 * 2 ** min(attempts, 10)), self.intervalle(job.priorite))
+            prochaine = finished_at + retry
+            values = {'attempts': attempts}
+        else:
+            # Calculé en base : la priorité a pu changer pendant l'exécution
+            prochaine = case(
+                {priorite: finished_at + intervalle for priorite, intervalle in self.intervalles.items()},
+                value=Job.priorite,
+                else_=finished_at + self.intervalle(PRIORITE_DEFAUT)
+            )
+            values = {'attempts': 0, 'last_run_at': started_at}
+
+        values.update({
+            # Relance demandée pendant l'exécution (urgence, critères) : repasser tout de suite
+            'next_run_at': case((Job.relancer.is_(True), finished_at), else_=prochaine),
+            'relancer': False,
+            'last_error': erreur,
+            'last_duration_ms': int((finished_at - started_at).total_seconds() * 1000),
+            'last_lag_ms': int(lag * 1000),
+            'last_finished_at': finished_at,
+            'lease_owner': None,
+            'lease_expires_at': None
+        })
+        Job.query.filter_by(id=job_id, lease_owner=self.owner).update(values, synchronize_session=False)
+        self.db.session.commit()
+
+    # ---------- Métriques ----------
+
+    def stats(self):
+        """Métriques globales du shard de cet ordonnanceur"""
+        with self._context():
+            return {'shard': self.shard, **job_stats(self.db, self.job_model)}
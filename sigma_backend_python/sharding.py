@@ -0,0 +1,128 @@
+"""
+Sigma Matching - Répartition des données par agent
+Les tables leads, biens_proposes et matching_jobs sont réparties sur
+plusieurs bases (shards) ; users et historique_actions restent sur la base
+principale. Un annuaire associe chaque agent à son shard.
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
+
+SHARDED_TABLES = {'leads', 'biens_proposes', 'matching_jobs'}
+DEFAULT_SHARD = 'default'
+
+_router_lock = threading.Lock()
+
+
+def bind_key(shard):
+    return f'shard_{shard}'
+
+
+def load_directory(path):
+    """
+    Annuaire JSON :
+        {"default": "paris", "agents": {"12": "lyon"}}
+    Les agents absents sont affectés au shard par défaut.
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class ShardRouter:
+    """Associe agents et shards, et exécute une fonction sur tous les shards"""
+
+    def __init__(self, app, db):
+        self.db = db
+        self.urls = app.config.get('SHARD_DATABASE_URLS') or {}
+        self.shards = list(self.urls) or [DEFAULT_SHARD]
+        directory = load_directory(app.config.get('SHARD_DIRECTORY'))
+        self.default = directory.get('default', self.shards[0])
+        self.agents = {str(agent_id): shard for agent_id, shard in directory.get('agents', {}).items()}
+        # Créé ici plutôt qu'au premier appel : deux requêtes admin concurrentes
+        # ne peuvent pas construire chacune leur pool
+        self._executor = None
+        if len(self.shards) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+
+        inconnus = {self.default, *self.agents.values()} - set(self.shards)
+        if inconnus:
+            raise ValueError(f"Shards inconnus dans l'annuaire: {sorted(inconnus)}")
+
+    @property
+    def enabled(self):
+        return bool(self.urls)
+
+    def engine(self, shard):
+        if not self.enabled:
+            return self.db.engine
+        return self.db.engines[bind_key(shard)]
+
+    def shard_for_agent(self, agent_id):
+        return self.agents.get(str(agent_id), self.default)
+
+    def fan_out(self, fn):
+        """
+        Exécuter fn() sur chaque shard en parallèle, chacun dans son propre
+        contexte applicatif (donc sa propre session), et retourner
+        {shard: résultat}
+        """
+        app = current_app._get_current_object()
+
+        def run(shard):
+            with app.app_context():
+                g.shard = shard
+                return fn()
+
+        if self._executor is None:
+            return {self.shards[0]: run(self.shards[0])}
+
+        futures = {shard: self._executor.submit(run, shard) for shard in self.shards}
+        return {shard: future.result() for shard, future in futures.items()}
+
+
+def get_shard_router():
+    router = current_app.extensions.get('shard_router')
+    if router is None:
+        # Première requête servie par plusieurs threads : un seul routeur (et un seul pool)
+        with _router_lock:
+            router = current_app.extensions.get('shard_router')
+            if router is None:
+                router = current_app.extensions['shard_router'] = ShardRouter(
+                    current_app, current_app.extensions['sqlalchemy']
+                )
+    return router
+
+
+def current_shard():
+    return g.get('shard') if has_app_context() else None
+
+
+class ShardNotBoundError(RuntimeError):
+    """Accès à une table répartie sans shard lié au contexte"""
+
+
+class ShardedSession(Session):
+    """
+    Session dont les tables réparties utilisent le moteur du shard courant
+    (g.shard). Sans shard, l'accès échoue au lieu de retomber sur la base
+    principale, qui ne contient pas ces tables.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None and inspect(mapper).local_table.name in SHARDED_TABLES:
+            router = get_shard_router()
+            shard = current_shard()
+            if shard is not None:
+                return router.engine(shard)
+            if router.enabled:
+                raise ShardNotBoundError(
+                    f"Table {inspect(mapper).local_table.name} accédée sans shard (g.shard non défini)"
+                )
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,87 @@
+import os
+
+# Import de app.py sans base PostgreSQL disponible
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pytest
+
+import app as sigma
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = sigma.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'main.db'}",
+        'LISTING_STORE_DIR': str(tmp_path / 'listings'),
+    })
+    with app.app_context():
+        sigma.bootstrap_database()
+    return app
+
+
+@pytest.fixture
+def lead_factory():
+    """Lead non enregistré, avec des critères par défaut"""
+    def make_lead(agent_id=1, urgence='MOYENNE', **values):
+        values = {
+            'nom': 'Martin',
+            'prenom': 'Anne',
+            'type_bien': 'APPARTEMENT',
+            'budget_max_eur': 300000,
+            'villes': ['Paris'],
+            **values,
+        }
+        return sigma.Lead(agent_id=agent_id, urgence=urgence, **values)
+    return make_lead
+
+
+@pytest.fixture
+def bien_factory():
+    """Bien non enregistré, rattaché au lead donné"""
+    def make_bien(lead_id, source_id, **values):
+        values = {
+            'source': 'LEBONCOIN',
+            'titre': 'Appartement 2 pièces',
+            'url': f'https://example.com/{source_id}',
+            'prix_eur': 250000,
+            'ville': 'Paris',
+            'type_bien': 'APPARTEMENT',
+            'surface_m2': 45,
+            'nb_pieces': 2,
+            **values,
+        }
+        return sigma.BienPropose(lead_id=lead_id, source_id=str(source_id), **values)
+    return make_bien
+
+
+@pytest.fixture
+def n8n(monkeypatch):
+    """Appels aux workflows n8n interceptés : liste de (nom, données)"""
+    appels = []
+    monkeypatch.setattr(sigma, 'trigger_n8n_workflow', lambda name, data: appels.append((name, data)))
+    return appels
+
+
+@pytest.fixture
+def sharded_app(tmp_path):
+    """Deux shards SQLite : l'agent 3 est sur « b », les autres sur « a »"""
+    directory = tmp_path / 'shards.json'
+    directory.write_text('{"default": "a", "agents": {"3": "b"}}')
+    app = sigma.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'main.db'}",
+        'SHARD_DATABASE_URLS': {
+            'a': f"sqlite:///{tmp_path / 'shard_a.db'}",
+            'b': f"sqlite:///{tmp_path / 'shard_b.db'}",
+        },
+        'SHARD_DIRECTORY': str(directory),
+        'LISTING_STORE_DIR': str(tmp_path / 'listings'),
+    })
+    with app.app_context():
+        sigma.bootstrap_database()
+        for email in ('agent-a@example.com', 'agent-b@example.com'):
+            agent = sigma.User(email=email, first_name='Agent', last_name='Test')
+            sigma.db.session.add(agent)
+        sigma.db.session.commit()
+    return app
@@ -0,0 +1,181 @@
+"""Tests du stockage colonnaire des biens"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from listing_store import ListingStore, code_statut
+
+SCHEMA = ("""
+    CREATE TABLE leads (
+        id INTEGER PRIMARY KEY,
+        agent_id INTEGER NOT NULL
+    )
+""", """
+    CREATE TABLE biens_proposes (
+        id INTEGER PRIMARY KEY,
+        lead_id INTEGER NOT NULL,
+        prix_eur INTEGER NOT NULL,
+        ville VARCHAR(100),
+        surface_m2 INTEGER,
+        type_bien VARCHAR(20),
+        nb_pieces INTEGER,
+        score_match INTEGER,
+        statut VARCHAR(20),
+        date_detection DATETIME,
+        updated_at DATETIME NOT NULL
+    )
+""", """
+    INSERT INTO leads (id, agent_id) VALUES (1, 1), (2, 2)
+""")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'biens.db'}")
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+    return engine
+
+
+def insert_bien(engine, id, lead_id=1, prix_eur=200000, ville='Paris', surface_m2=50, type_bien='APPARTEMENT',
+                nb_pieces=2, statut='NOUVEAU', date_detection=None, updated_at=None):
+    date_detection = date_detection or datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(text("""
+            INSERT INTO biens_proposes (id, lead_id, prix_eur, ville, surface_m2, type_bien,
+                                        nb_pieces, score_match, statut, date_detection, updated_at)
+            VALUES (:id, :lead_id, :prix_eur, :ville, :surface_m2, :type_bien, :nb_pieces, 80, :statut,
+                    :date_detection, :updated_at)
+        """), dict(id=id, lead_id=lead_id, prix_eur=prix_eur, ville=ville, surface_m2=surface_m2, type_bien=type_bien,
+                   nb_pieces=nb_pieces, statut=statut, date_detection=date_detection,
+                   updated_at=updated_at or date_detection))
+
+
+def update_bien(engine, id, **values):
+    values['updated_at'] = datetime.utcnow()
+    assignments = ', '.join(f'{key} = :{key}' for key in values)
+    with engine.begin() as connection:
+        connection.execute(text(f"UPDATE biens_proposes SET {assignments} WHERE id = :id"), dict(values, id=id))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ListingStore(str(tmp_path / 'store'), reload_interval=0)
+
+
+def test_snapshot_absent_before_first_refresh(store):
+    assert store.snapshot() is None
+
+
+def test_mask_keeps_missing_values_within_bounds(engine, store):
+    insert_bien(engine, 1, surface_m2=None, nb_pieces=None)
+    insert_bien(engine, 2, surface_m2=30, nb_pieces=1)
+    insert_bien(engine, 3, surface_m2=80, nb_pieces=4)
+    snapshot = store.refresh(engine)
+
+    mask = snapshot.mask(surface_min=40, nb_pieces_min=2)
+    assert snapshot['id'][mask].tolist() == [1, 3]
+
+    mask = snapshot.mask(surface_max=60, nb_pieces_max=3)
+    assert snapshot['id'][mask].tolist() == [1, 2]
+
+
+def test_mask_filters_type_ville_prix_and_statut(engine, store):
+    insert_bien(engine, 1, ville=' paris ', prix_eur=300000)
+    insert_bien(engine, 2, ville='Lyon')
+    insert_bien(engine, 3, type_bien='MAISON')
+    insert_bien(engine, 4, statut='REJETE')
+    snapshot = store.refresh(engine)
+
+    mask = snapshot.mask(type_bien='appartement', villes=['PARIS'], prix_max=250000,
+                         exclure_statuts=['REJETE'])
+    assert snapshot['id'][mask].tolist() == []
+    mask = snapshot.mask(type_bien='APPARTEMENT', villes=['Paris'], exclure_statuts=['REJETE'])
+    assert snapshot['id'][mask].tolist() == [1]
+
+
+def test_mask_filters_on_owning_agent(engine, store):
+    insert_bien(engine, 1, lead_id=1)
+    insert_bien(engine, 2, lead_id=2)
+    snapshot = store.refresh(engine)
+
+    assert snapshot['agent_id'].tolist() == [1, 2]
+    assert snapshot['id'][snapshot.mask(agent_id=2)].tolist() == [2]
+
+
+def test_generation_without_new_column_is_rebuilt(engine, store):
+    insert_bien(engine, 1, lead_id=2)
+    first = store.refresh(engine)
+    # Génération publiée avant l'ajout de la colonne agent_id
+    os.remove(os.path.join(first.path, 'agent_id.npy'))
+    store.reload_interval = 0
+
+    assert store.snapshot() is None
+    snapshot = store.refresh(engine)
+    assert snapshot.manifest['generation'] != first.manifest['generation']
+    assert snapshot['agent_id'].tolist() == [2]
+
+
+def test_incremental_refresh_appends_new_rows(engine, store):
+    insert_bien(engine, 1)
+    first = store.refresh(engine)
+    insert_bien(engine, 2)
+    second = store.refresh(engine)
+
+    assert second.manifest['generation'] != first.manifest['generation']
+    assert second['id'].tolist() == [1, 2]
+    assert second.last_id == 2
+    assert store.snapshot().manifest['generation'] == second.manifest['generation']
+
+
+def test_refresh_without_changes_keeps_generation(engine, store):
+    insert_bien(engine, 1)
+    first = store.refresh(engine)
+    assert store.refresh(engine).manifest['generation'] == first.manifest['generation']
+
+
+def test_refresh_picks_up_updated_rows(engine, store):
+    insert_bien(engine, 1, date_detection=datetime.utcnow() - timedelta(days=2))
+    store.refresh(engine)
+    update_bien(engine, 1, prix_eur=150000, statut='REJETE')
+
+    snapshot = store.refresh(engine)
+    assert snapshot['id'].tolist() == [1]
+    assert snapshot['prix_eur'].tolist() == [150000]
+    assert snapshot['statut'].tolist() == [code_statut('REJETE')]
+
+
+def test_refresh_picks_up_lower_id_committed_late(engine, store):
+    insert_bien(engine, 1)
+    insert_bien(engine, 3)
+    store.refresh(engine)
+    # id 2 réservé avant 3 mais validé après le rafraîchissement
+    insert_bien(engine, 2)
+
+    assert store.refresh(engine)['id'].tolist() == [1, 2, 3]
+
+
+def test_full_refresh_drops_deleted_rows(engine, store):
+    insert_bien(engine, 1)
+    insert_bien(engine, 2)
+    store.refresh(engine)
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM biens_proposes WHERE id = 1"))
+
+    assert store.refresh(engine)['id'].tolist() == [1, 2]
+    assert store.refresh(engine, full=True)['id'].tolist() == [2]
+
+
+def test_stats_ignore_missing_surface(engine, store):
+    insert_bien(engine, 1, prix_eur=100000, surface_m2=50)
+    insert_bien(engine, 2, prix_eur=300000, surface_m2=None)
+    stats = store.refresh(engine).stats()
+
+    assert stats['total'] == 2
+    assert stats['prix_median'] == 200000
+    assert stats['prix_m2_median'] == 2000
+    assert stats['par_type']['APPARTEMENT'] == {'total': 2, 'prix_median': 200000, 'prix_m2_median': 2000}
@@ -0,0 +1,237 @@
+"""Tests de l'ordonnanceur des jobs de matching"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from flask import g
+
+import app as sigma
+from matching_jobs import MatchingScheduler, job_stats
+
+
+def make_scheduler(app, handler=None, owner=None):
+    scheduler = MatchingScheduler(app, sigma.db, sigma.MatchingJob, handler or (lambda job: None),
+                                  shard='default')
+    if owner:
+        scheduler.owner = owner
+    return scheduler
+
+
+@pytest.fixture
+def add_leads(app, lead_factory):
+    """Leads actifs (une urgence par lead) et leurs jobs, retourne leurs id"""
+    def add(*urgences):
+        with app.app_context():
+            g.shard = 'default'
+            leads = [lead_factory(urgence=urgence) for urgence in urgences]
+            sigma.db.session.add_all(leads)
+            sigma.db.session.commit()
+            sigma.sync_matching_jobs()
+            return [lead.id for lead in leads]
+    return add
+
+
+def get_job(app, lead_id):
+    with app.app_context():
+        g.shard = 'default'
+        return sigma.MatchingJob.query.filter_by(lead_id=lead_id).one()
+
+
+def drain(scheduler):
+    items = []
+    while not scheduler._queue.empty():
+        items.append(scheduler._queue.get_nowait())
+    return items
+
+
+def test_sync_creates_one_job_per_active_lead(app, add_leads, lead_factory):
+    lead_ids = add_leads('FORTE', 'FAIBLE')
+    with app.app_context():
+        g.shard = 'default'
+        closed = lead_factory(statut='CLOS')
+        sigma.db.session.add(closed)
+        sigma.db.session.commit()
+        # Exécutions concurrentes : l'insertion ignore les jobs déjà créés
+        sigma.sync_matching_jobs()
+        sigma.insert_matching_jobs([{'lead_id': lead_ids[0], 'priorite': 0}])
+        sigma.db.session.commit()
+
+        jobs = sigma.MatchingJob.query.order_by(sigma.MatchingJob.lead_id).all()
+        assert [(job.lead_id, job.priorite) for job in jobs] == [(lead_ids[0], 0), (lead_ids[1], 2)]
+
+
+def test_sync_removes_jobs_of_closed_leads(app, add_leads):
+    lead_id, = add_leads('MOYENNE')
+    with app.app_context():
+        g.shard = 'default'
+        sigma.db.session.get(sigma.Lead, lead_id).statut = 'CLOS'
+        sigma.db.session.commit()
+        sigma.sync_matching_jobs()
+        assert sigma.MatchingJob.query.count() == 0
+
+
+def test_claims_follow_priority_order(app, add_leads):
+    faible, forte, moyenne = add_leads('FAIBLE', 'FORTE', 'MOYENNE')
+    scheduler = make_scheduler(app)
+    with scheduler._context():
+        scheduler._claim_due_jobs()
+
+    job_ids = [item[-1] for item in drain(scheduler)]
+    expected = [get_job(app, lead_id).id for lead_id in (forte, moyenne, faible)]
+    assert job_ids == expected
+
+
+def test_job_is_claimed_once_per_lease(app, add_leads):
+    lead_id, = add_leads('FORTE')
+    first = make_scheduler(app, owner='host-a:1')
+    second = make_scheduler(app, owner='host-b:2')
+
+    with first._context():
+        first._claim_due_jobs()
+    with second._context():
+        second._claim_due_jobs()
+
+    assert len(drain(first)) == 1
+    assert drain(second) == []
+    assert get_job(app, lead_id).lease_owner == 'host-a:1'
+
+
+def test_expired_lease_can_be_reclaimed(app, add_leads):
+    lead_id, = add_leads('FORTE')
+    with app.app_context():
+        g.shard = 'default'
+        job = sigma.MatchingJob.query.filter_by(lead_id=lead_id).one()
+        job.lease_owner = 'host-a:1'
+        job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        sigma.db.session.commit()
+
+    scheduler = make_scheduler(app, owner='host-b:2')
+    with scheduler._context():
+        scheduler._claim_due_jobs()
+    assert len(drain(scheduler)) == 1
+
+
+def run_once(scheduler):
+    with scheduler._context():
+        scheduler._claim_due_jobs()
+    for _, due_at, _, job_id in drain(scheduler):
+        with scheduler._context():
+            scheduler._execute(job_id, due_at)
+        scheduler._queued.discard(job_id)
+
+
+def test_failed_job_retries_with_backoff(app, add_leads):
+    lead_id, = add_leads('FAIBLE')
+
+    def handler(job):
+        raise RuntimeError('n8n indisponible')
+
+    scheduler = make_scheduler(app, handler)
+    for attempts, delay in ((1, 60), (2, 120)):
+        before = datetime.utcnow()
+        run_once(scheduler)
+        job = get_job(app, lead_id)
+        assert job.attempts == attempts
+        assert job.last_error == 'n8n indisponible'
+        assert job.lease_owner is None
+        assert before + timedelta(seconds=delay) <= job.next_run_at <= datetime.utcnow() + timedelta(seconds=delay)
+        with app.app_context():
+            g.shard = 'default'
+            sigma.MatchingJob.query.update({'next_run_at': datetime.utcnow()})
+            sigma.db.session.commit()
+
+
+def test_successful_job_waits_for_urgence_interval(app, add_leads):
+    forte, faible = add_leads('FORTE', 'FAIBLE')
+    run_once(make_scheduler(app))
+
+    now = datetime.utcnow()
+    assert get_job(app, forte).next_run_at == pytest.approx(now + timedelta(minutes=5), abs=timedelta(seconds=5))
+    assert get_job(app, faible).next_run_at == pytest.approx(now + timedelta(hours=2), abs=timedelta(seconds=5))
+    assert get_job(app, forte).attempts == 0
+
+
+def test_reschedule_during_run_is_not_lost(app, add_leads):
+    lead_id, = add_leads('FAIBLE')
+
+    def handler(job):
+        # Urgence modifiée par l'agent pendant l'exécution (autre session)
+        with app.app_context():
+            g.shard = 'default'
+            lead = sigma.db.session.get(sigma.Lead, lead_id)
+            lead.urgence = 'FORTE'
+            sigma.db.session.commit()
+            sigma.schedule_lead_matching(lead)
+
+    run_once(make_scheduler(app, handler))
+    job = get_job(app, lead_id)
+    assert job.priorite == 0
+    assert job.relancer is False
+    assert job.next_run_at <= datetime.utcnow()
+
+
+def test_stats_come_from_the_table(app, add_leads):
+    add_leads('FORTE', 'MOYENNE')
+    run_once(make_scheduler(app, owner='worker:1'))
+
+    # Processus qui n'exécute aucun job (API sans ordonnanceur embarqué)
+    with app.app_context():
+        g.shard = 'default'
+        stats = job_stats(sigma.db, sigma.MatchingJob)
+    assert stats['jobs_total'] == 2
+    assert stats['jobs_dus'] == 0
+    assert stats['debit_par_minute'] == pytest.approx(2 * 60 / 300)
+    assert stats['retard_moyen_s'] is not None
+
+
+def test_listing_added_between_refreshes_is_proposed(app, n8n, add_leads, lead_factory, bien_factory):
+    lead_id, = add_leads('FORTE')
+    with app.app_context():
+        g.shard = 'default'
+        autre = lead_factory()
+        sigma.db.session.add(autre)
+        sigma.db.session.commit()
+        autre_id = autre.id
+        sigma.db.session.add(bien_factory(autre_id, 1))
+        sigma.db.session.commit()
+        store = sigma.get_listing_store('default')
+        store.reload_interval = 0
+        store.refresh(sigma.db.engine)
+
+    def run_job():
+        with app.app_context():
+            g.shard = 'default'
+            job = sigma.MatchingJob.query.filter_by(lead_id=lead_id).one()
+            sigma.run_matching_job(job)
+            sigma.db.session.commit()
+        return n8n[-1][1]['candidats']
+
+    premier = run_job()
+    assert len(premier) == 1
+
+    with app.app_context():
+        g.shard = 'default'
+        sigma.db.session.add(bien_factory(autre_id, 2))
+        sigma.db.session.commit()
+    # Passage avant le rafraîchissement suivant : rien de nouveau dans le stockage
+    assert run_job() == []
+
+    with app.app_context():
+        store.refresh(sigma.db.engine)
+    assert run_job() == [premier[0] + 1]
+
+
+def test_listings_of_other_agents_are_not_proposed(app, n8n, add_leads, lead_factory, bien_factory):
+    lead_id, = add_leads('FORTE')
+    with app.app_context():
+        g.shard = 'default'
+        meme_agent, autre_agent = lead_factory(agent_id=1), lead_factory(agent_id=2)
+        sigma.db.session.add_all([meme_agent, autre_agent])
+        sigma.db.session.commit()
+        sigma.db.session.add_all([bien_factory(meme_agent.id, 1), bien_factory(autre_agent.id, 2)])
+        sigma.db.session.commit()
+        propose = sigma.BienPropose.query.filter_by(lead_id=meme_agent.id).one().id
+        sigma.get_listing_store('default').refresh(sigma.db.engine)
+
+        sigma.run_matching_job(sigma.MatchingJob.query.filter_by(lead_id=lead_id).one())
+    assert n8n[-1][1]['candidats'] == [propose]
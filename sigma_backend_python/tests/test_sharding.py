@@ -0,0 +1,192 @@
+"""Tests du routage des données par shard"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import g
+from flask_jwt_extended import create_access_token
+from sqlalchemy import inspect
+
+import app as sigma
+from sharding import ShardNotBoundError
+
+ADMIN_ID, AGENT_A_ID, AGENT_B_ID = 1, 2, 3
+
+
+def auth(app, user_id):
+    with app.app_context():
+        return {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+
+
+@pytest.fixture
+def add_lead(sharded_app, lead_factory, bien_factory):
+    """Lead et un bien enregistrés sur le shard donné, retourne l'id du lead"""
+    def add(shard, agent_id, **values):
+        with sharded_app.app_context():
+            g.shard = shard
+            lead = lead_factory(agent_id=agent_id, **values)
+            sigma.db.session.add(lead)
+            sigma.db.session.commit()
+            sigma.db.session.add(bien_factory(lead.id, f'{shard}-{lead.id}'))
+            sigma.db.session.commit()
+            return lead.id
+    return add
+
+
+def shard_leads(app, shard):
+    with app.app_context():
+        g.shard = shard
+        return [(lead.id, lead.agent_id, lead.nom) for lead in sigma.Lead.query.order_by(sigma.Lead.id)]
+
+
+def test_sharded_tables_only_exist_on_shards(sharded_app):
+    with sharded_app.app_context():
+        router = sigma.get_shard_router()
+        assert 'leads' not in inspect(sigma.db.engine).get_table_names()
+        assert 'users' in inspect(sigma.db.engine).get_table_names()
+        for shard in ('a', 'b'):
+            tables = inspect(router.engine(shard)).get_table_names()
+            assert {'leads', 'biens_proposes', 'matching_jobs'} <= set(tables)
+            assert 'users' not in tables
+
+
+def test_sharded_table_without_shard_fails(sharded_app):
+    with sharded_app.app_context():
+        with pytest.raises(ShardNotBoundError):
+            sigma.Lead.query.count()
+
+
+def test_agent_requests_are_routed_to_their_shard(sharded_app, n8n):
+    client = sharded_app.test_client()
+    response = client.post('/api/leads', headers=auth(sharded_app, AGENT_B_ID), json={
+        'nom': 'Durand', 'prenom': 'Luc', 'type_bien': 'MAISON',
+        'budget_max_eur': 400000, 'villes': ['Lyon']
+    })
+    assert response.status_code == 201
+
+    assert shard_leads(sharded_app, 'a') == []
+    assert shard_leads(sharded_app, 'b') == [(1, AGENT_B_ID, 'Durand')]
+    assert n8n[-1][0] == 'lead-created'
+    assert n8n[-1][1]['shard'] == 'b'
+
+    leads_b = client.get('/api/leads', headers=auth(sharded_app, AGENT_B_ID)).get_json()
+    leads_a = client.get('/api/leads', headers=auth(sharded_app, AGENT_A_ID)).get_json()
+    assert [lead['nom'] for lead in leads_b['leads']] == ['Durand']
+    assert leads_a['total'] == 0
+
+
+def test_agent_cannot_read_lead_of_same_id_on_other_shard(sharded_app, add_lead):
+    add_lead('a', AGENT_A_ID, nom='Alpha')
+    add_lead('b', AGENT_B_ID, nom='Beta')
+    client = sharded_app.test_client()
+
+    response = client.get('/api/leads/1', headers=auth(sharded_app, AGENT_B_ID))
+    assert response.get_json()['lead']['nom'] == 'Beta'
+    response = client.get('/api/leads/1/biens', headers=auth(sharded_app, AGENT_A_ID))
+    assert response.get_json()['biens'][0]['source_id'] == 'a-1'
+
+
+def test_admin_stats_are_merged_across_shards(sharded_app, add_lead):
+    add_lead('a', AGENT_A_ID)
+    add_lead('a', AGENT_A_ID, statut='CLOS')
+    add_lead('b', AGENT_B_ID)
+
+    stats = sharded_app.test_client().get('/api/admin/stats', headers=auth(sharded_app, ADMIN_ID)).get_json()
+    assert stats['total_users'] == 3
+    assert stats['total_leads'] == 3
+    assert stats['active_leads'] == 2
+    assert stats['total_biens'] == 3
+    assert stats['shards']['a']['total_leads'] == 2
+    assert stats['shards']['b']['total_leads'] == 1
+
+
+def test_admin_users_include_shard_and_merged_lead_counts(sharded_app, add_lead):
+    add_lead('a', AGENT_A_ID)
+    add_lead('a', AGENT_A_ID)
+    add_lead('b', AGENT_B_ID)
+
+    users = sharded_app.test_client().get('/api/admin/users', headers=auth(sharded_app, ADMIN_ID)).get_json()
+    par_id = {user['id']: user for user in users['users']}
+    assert (par_id[AGENT_A_ID]['shard'], par_id[AGENT_A_ID]['total_leads']) == ('a', 2)
+    assert (par_id[AGENT_B_ID]['shard'], par_id[AGENT_B_ID]['total_leads']) == ('b', 1)
+    assert par_id[ADMIN_ID]['total_leads'] == 0
+
+
+def test_admin_lead_list_tags_each_lead_with_its_shard(sharded_app, add_lead):
+    add_lead('a', AGENT_A_ID, nom='Alpha')
+    add_lead('b', AGENT_B_ID, nom='Beta')
+
+    leads = sharded_app.test_client().get('/api/leads', headers=auth(sharded_app, ADMIN_ID)).get_json()
+    assert sorted((lead['id'], lead['shard'], lead['nom']) for lead in leads['leads']) == [
+        (1, 'a', 'Alpha'), (1, 'b', 'Beta')
+    ]
+
+
+def test_admin_lookup_by_colliding_id_needs_explicit_shard(sharded_app, add_lead):
+    add_lead('a', AGENT_A_ID, nom='Alpha')
+    add_lead('b', AGENT_B_ID, nom='Beta')
+    client = sharded_app.test_client()
+    headers = auth(sharded_app, ADMIN_ID)
+
+    assert client.get('/api/leads/1', headers=headers).status_code == 400
+    assert client.get('/api/leads/1?shard=c', headers=headers).status_code == 400
+    assert client.get('/api/leads/1?shard=a', headers=headers).get_json()['lead']['nom'] == 'Alpha'
+    assert client.get('/api/leads/1?shard=b', headers=headers).get_json()['lead']['nom'] == 'Beta'
+    assert client.get('/api/leads/1/biens?shard=b', headers=headers).get_json()['biens'][0]['source_id'] == 'b-1'
+
+
+def test_admin_writes_by_id_touch_only_the_requested_shard(sharded_app, n8n, add_lead):
+    add_lead('a', AGENT_A_ID, nom='Alpha')
+    add_lead('b', AGENT_B_ID, nom='Beta')
+    client = sharded_app.test_client()
+    headers = auth(sharded_app, ADMIN_ID)
+
+    assert client.put('/api/leads/1', headers=headers, json={'nom': 'Gamma'}).status_code == 400
+    response = client.put('/api/leads/1?shard=b', headers=headers, json={'nom': 'Gamma'})
+    assert response.status_code == 200
+    assert shard_leads(sharded_app, 'a') == [(1, AGENT_A_ID, 'Alpha')]
+    assert shard_leads(sharded_app, 'b') == [(1, AGENT_B_ID, 'Gamma')]
+
+    response = client.put('/api/biens/1/statut?shard=b', headers=headers, json={'statut': 'REJETE'})
+    assert response.status_code == 200
+    for shard, statut in (('a', 'NOUVEAU'), ('b', 'REJETE')):
+        with sharded_app.app_context():
+            g.shard = shard
+            assert sigma.db.session.get(sigma.BienPropose, 1).statut == statut
+
+
+def test_admin_biens_stats_merge_all_shards(sharded_app, add_lead, bien_factory):
+    add_lead('a', AGENT_A_ID)
+    lead_b = add_lead('b', AGENT_B_ID)
+    with sharded_app.app_context():
+        g.shard = 'b'
+        sigma.db.session.add(bien_factory(lead_b, 'b-2', prix_eur=400000))
+        sigma.db.session.commit()
+        router = sigma.get_shard_router()
+        for shard in router.shards:
+            sigma.get_listing_store(shard).refresh(router.engine(shard))
+    client = sharded_app.test_client()
+    headers = auth(sharded_app, ADMIN_ID)
+
+    stats = client.get('/api/admin/biens/stats', headers=headers).get_json()
+    # Médiane exacte sur l'union des shards (250000, 250000, 400000)
+    assert (stats['total'], stats['prix_median']) == (3, 250000)
+    assert stats['shards']['a']['total'] == 1
+    assert (stats['shards']['b']['total'], stats['shards']['b']['prix_median']) == (2, 325000)
+
+    assert client.get('/api/admin/biens/stats?shard=b', headers=headers).get_json()['total'] == 2
+    assert client.get('/api/admin/biens/stats?shard=c', headers=headers).status_code == 400
+
+
+def test_concurrent_first_requests_share_one_router(sharded_app):
+    # Routeur déjà créé par init-db dans la fixture : repartir de zéro
+    sharded_app.extensions.pop('shard_router')
+
+    def router():
+        with sharded_app.app_context():
+            return sigma.get_shard_router()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        routers = set(map(id, executor.map(lambda _: router(), range(32))))
+    assert len(routers) == 1
+    assert router()._executor is not None